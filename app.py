@@ -1,7 +1,32 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
-from datetime import datetime
+import re
+import traceback
+from collections import defaultdict, namedtuple
+from datetime import datetime, time
+from itertools import chain
+import xlsxwriter
+from xlsxwriter.utility import xl_rowcol_to_cell
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+
+# Arrow-backed strings make the order ID normalization a C-level pass
+try:
+    import pyarrow  # noqa: F401
+    KEY_DTYPE = 'string[pyarrow]'
+except ImportError:
+    KEY_DTYPE = 'string'
+
+# Uploads kept in each st.cache_data cache before the oldest is evicted
+CACHE_MAX_ENTRIES = 16
+
+# One uploaded workbook; the bytes and sheet names key the cached matching
+Upload = namedtuple('Upload', ['name', 'file_id', 'file_bytes', 'noc_sheet', 'rec_sheet', 'noc_df', 'rec_df'])
+
+# Results of one Process Sheets click, kept in session state across reruns
+Processed = namedtuple('Processed', ['uploads_key', 'results', 'failures', 'download', 'write_error', 'timestamp'])
 
 # Set page config
 st.set_page_config(
@@ -57,186 +82,378 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+NOC_SHEET_NAMES = ('noc', 'nov')  # in order of preference
+
 def find_sheet_names(sheets):
     """Find NOC/NOV and REC sheets regardless of case"""
-    noc_sheet = None
-    rec_sheet = None
-    
-    for sheet in sheets:
-        sheet_lower = sheet.lower()
-        if sheet_lower in ['noc', 'nov']:
-            noc_sheet = sheet
-        elif sheet_lower == 'rec':
-            rec_sheet = sheet
-            
+    # Reversed so the first sheet wins when names differ only by case
+    lookup = {sheet.casefold(): sheet for sheet in reversed(sheets)}
+    noc_sheet = next((lookup[name] for name in NOC_SHEET_NAMES if name in lookup), None)
+    rec_sheet = lookup.get('rec')
     return noc_sheet, rec_sheet
 
+ORDER_ID_COLUMNS = ('order_id', 'Order ID', 'OrderID', 'orderid', 'Order Id')
+PRODUCT_NAME_COLUMNS = ('Product Name', 'product_name', 'ProductName', 'ITEM NAME', 'Item Name')
+
 def get_order_id_column(df):
     """Find the order ID column name in the dataframe"""
-    possible_names = ['order_id', 'Order ID', 'OrderID', 'orderid', 'Order Id']
-    for name in possible_names:
-        if name in df.columns:
+    columns = set(df.columns)
+    for name in ORDER_ID_COLUMNS:
+        if name in columns:
             return name
     return df.columns[0]  # Return first column if no match found
 
 def get_product_name_column(df):
     """Find the product name column in the dataframe"""
-    possible_names = ['Product Name', 'product_name', 'ProductName', 'ITEM NAME', 'Item Name']
-    for name in possible_names:
-        if name in df.columns:
+    columns = set(df.columns)
+    for name in PRODUCT_NAME_COLUMNS:
+        if name in columns:
             return name
     return df.columns[1]  # Return second column if no match found
 
-def process_sheets(noc_df, rec_df):
+# Read-only openpyxl returns Excel error cells (#N/A, #REF!, ...) as text;
+# pd.read_excel treated them, and pandas' default NA strings, as missing
+NA_VALUES = sorted(set(ERROR_CODES) | {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+})
+
+def dedupe_columns(header):
+    """Name blank headers and suffix duplicates the way pd.read_excel does"""
+    columns = [name if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+    # Named columns claim their names before the unnamed ones
+    order = [i for i, name in enumerate(header) if name is not None]
+    order += [i for i, name in enumerate(header) if name is None]
+    counts = defaultdict(int)
+    for i in order:
+        name = base = columns[i]
+        count = counts[base]
+        while count > 0:
+            counts[base] = count + 1
+            name = f"{base}.{count}"
+            count = count + 1 if name in columns else counts[name]
+        columns[i] = name
+        counts[name] = count + 1
+    return columns
+
+def read_sheet_fast(ws):
+    """Stream a read-only worksheet into a dataframe, first row as header"""
+    # Trim trailing empty cells and rows, which styled-but-blank cells
+    # leave behind, then pad rows back to a common width
+    rows = []
+    last_row_with_data = -1
+    for row in ws.iter_rows(values_only=True):
+        row = list(row)
+        while row and row[-1] is None:
+            row.pop()
+        if row:
+            last_row_with_data = len(rows)
+        rows.append(row)
+    del rows[last_row_with_data + 1:]
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(row) for row in rows)
+    header, *data = [row + [None] * (width - len(row)) for row in rows]
+    df = pd.DataFrame(data, columns=dedupe_columns(header))
+    return df.mask(df.isin(NA_VALUES)).infer_objects()
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_workbook_sheets(file_bytes):
+    """Parse every sheet of the uploaded workbook once per distinct file"""
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
     try:
-        # Debug information
-        st.markdown('<div class="column-info">', unsafe_allow_html=True)
-        st.write("NOC Sheet Columns:", list(noc_df.columns))
-        st.write("REC Sheet Columns:", list(rec_df.columns))
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Handle NaN values
-        noc_df = noc_df.fillna('')
-        rec_df = rec_df.fillna('')
-        
-        # Get column names dynamically
-        noc_order_id_col = get_order_id_column(noc_df)
-        noc_product_name_col = get_product_name_column(noc_df)
-        rec_order_id_col = get_order_id_column(rec_df)
-        
-        # Create mapping from NOC sheet
-        order_map = {}
-        for _, row in noc_df.iterrows():
-            if row[noc_order_id_col]:
-                order_map[str(row[noc_order_id_col]).strip()] = row[noc_product_name_col]
-        
-        # Ensure ITEM NAME column exists
-        if 'ITEM NAME' not in rec_df.columns:
-            rec_df['ITEM NAME'] = ''
-        
-        # Update REC sheet with matched items
-        for idx, row in rec_df.iterrows():
-            order_id = str(row[rec_order_id_col]).strip()
-            if order_id in order_map:
-                rec_df.at[idx, 'ITEM NAME'] = order_map[order_id]
-        
-        return rec_df
-    except Exception as e:
-        st.error(f"Error in processing: {str(e)}")
-        import traceback
-        st.error(f"Detailed error: {traceback.format_exc()}")
-        return None
+        return {ws.title: read_sheet_fast(ws) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+def normalize_keys(series):
+    """Normalize an order ID column to stripped strings, blanks for missing"""
+    keys = series.fillna('').astype(KEY_DTYPE).str.strip()
+    # Numeric IDs in a column with blanks load as floats; match 101.0 to 101
+    keys = keys.str.replace(r'^(-?\d+)\.0+$', r'\1', regex=True)
+    # Text IDs stay zero-padded while numeric cells do not; match 00123 to 123
+    return keys.str.replace(r'^(-?)0+(\d+)$', r'\1\2', regex=True)
+
+def result_sheet_names(file_names):
+    """Name one output sheet per upload, unique and valid for Excel"""
+    if len(file_names) == 1:
+        return ['Updated_REC']
+    names = []
+    for idx, file_name in enumerate(file_names, start=1):
+        # The index prefix keeps names unique once cut to Excel's 31 characters
+        stem = re.sub(r'[\[\]:*?/\\]', '_', file_name.rsplit('.', 1)[0])
+        names.append(f"{idx}_{stem}"[:31].rstrip("'"))
+    return names
+
+def write_sheets_fast(sheets):
+    """Write {sheet name: dataframe} to an in-memory xlsx, streaming rows in constant memory"""
+    buffer = io.BytesIO()
+    # strings_to_urls is off so URL-like text stays plain text, as with openpyxl
+    with xlsxwriter.Workbook(buffer, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+    }) as wb:
+        time_format = wb.add_format({'num_format': 'hh:mm:ss'})
+        for sheet_name, df in sheets.items():
+            ws = wb.add_worksheet(sheet_name)
+            write = ws.write
+            # xlsxwriter cannot write NaN/NaT, so blank those cells out
+            values = df.astype(object).where(df.notna(), None)
+            rows = chain([tuple(df.columns)], values.itertuples(index=False, name=None))
+            # constant_memory flushes each row once the next starts, so write in order
+            for row_idx, row in enumerate(rows):
+                for col_idx, value in enumerate(row):
+                    cell_format = time_format if isinstance(value, time) else None
+                    # A negative return means the cell was dropped or truncated
+                    error = write(row_idx, col_idx, value, cell_format)
+                    if error < 0:
+                        raise ValueError(
+                            f"Could not write cell {xl_rowcol_to_cell(row_idx, col_idx)} "
+                            f"of sheet {sheet_name} (xlsxwriter error {error})"
+                        )
+    return buffer
+
+def process_pair(noc_df, rec_df):
+    """Fill REC item names from NOC by order ID, returning (rec_df, matched count)"""
+    # Get column names dynamically
+    noc_order_id_col = get_order_id_column(noc_df)
+    noc_product_name_col = get_product_name_column(noc_df)
+    rec_order_id_col = get_order_id_column(rec_df)
+    
+    # Normalize order IDs once; handle NaN only in the columns used for matching
+    noc_keys = normalize_keys(noc_df[noc_order_id_col])
+    noc_items = noc_df[noc_product_name_col].fillna('')
+    rec_keys = normalize_keys(rec_df[rec_order_id_col])
+    
+    # Build a NOC lookup table, last occurrence of an order ID wins
+    has_key = noc_keys.ne('')
+    lookup = pd.DataFrame({
+        '_key': noc_keys[has_key],
+        '_item': noc_items[has_key]
+    }).drop_duplicates(subset=['_key'], keep='last')
+    
+    # Existing ITEM NAME values, blank if the column does not exist yet
+    if 'ITEM NAME' in rec_df.columns:
+        existing_items = rec_df['ITEM NAME'].fillna('')
+    else:
+        existing_items = pd.Series('', index=rec_df.index)
+    
+    # Factorize NOC keys to integer codes; the extra trailing slot
+    # absorbs the -1 code get_indexer returns for unmatched REC rows
+    codes, uniques = pd.factorize(lookup['_key'])
+    item_by_code = np.empty(len(uniques) + 1, dtype=object)
+    item_by_code[codes] = lookup['_item'].to_numpy(dtype=object)
+    
+    # Gather matched items for REC rows, keeping existing values otherwise
+    rec_codes = uniques.get_indexer(rec_keys)
+    rec_df = rec_df.assign(**{'ITEM NAME': np.where(
+        rec_codes >= 0,
+        item_by_code[rec_codes],
+        existing_items.to_numpy(dtype=object)
+    )})
+    
+    return rec_df, int((rec_codes >= 0).sum())
+
+PREVIEW_ROWS = 200
+
+def show_preview(df, show_full):
+    """Render a dataframe, capped at PREVIEW_ROWS rows unless show_full is set"""
+    if show_full or len(df) <= PREVIEW_ROWS:
+        st.dataframe(df, use_container_width=True)
+    else:
+        st.dataframe(df.head(PREVIEW_ROWS), use_container_width=True)
+        st.caption(f"Showing the first {PREVIEW_ROWS} rows")
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def process_upload(file_bytes, noc_sheet, rec_sheet):
+    """Match one uploaded workbook, cached on its exact bytes and sheet names"""
+    # Keyed on the bytes rather than the dataframes: Streamlit only hashes
+    # a sample of rows for large frames, which can serve stale results
+    workbook = load_workbook_sheets(file_bytes)
+    return process_pair(workbook[noc_sheet], workbook[rec_sheet])
+
+def process_many(uploads):
+    """Match every upload, returning (upload, result, matched count) rows and per-file failures"""
+    results = []
+    failures = []
+    for upload in uploads:
+        # One bad workbook must not throw away the results of the others
+        try:
+            result_df, matched = process_upload(upload.file_bytes, upload.noc_sheet, upload.rec_sheet)
+        except Exception as e:
+            failures.append((upload.name, str(e), traceback.format_exc()))
+            continue
+        results.append((upload, result_df, matched))
+    return results, failures
+
+def uploads_key(uploads):
+    """Identify a set of uploads, so stored results are only shown for them"""
+    return tuple((upload.file_id, upload.noc_sheet, upload.rec_sheet) for upload in uploads)
+
+def process_sheets(uploads):
+    """Match every upload and prepare the download, for storing in session state"""
+    results, failures = process_many(uploads)
+    download = write_error = None
+    if results:
+        # One sheet per successfully processed workbook
+        sheet_names = result_sheet_names([upload.name for upload, _, _ in results])
+        try:
+            download = write_sheets_fast(dict(zip(sheet_names, (df for _, df, _ in results)))).getvalue()
+        except ValueError as e:
+            write_error = str(e)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Processed(uploads_key(uploads), results, failures, download, write_error, timestamp)
+
+def show_results(uploads, processed):
+    """Render stored processing results; safe to call on every rerun"""
+    # Debug information
+    st.markdown('<div class="column-info">', unsafe_allow_html=True)
+    for upload in uploads:
+        st.markdown(f"**{upload.name}**")
+        st.write("NOC Sheet Columns:", list(upload.noc_df.columns))
+        st.write("REC Sheet Columns:", list(upload.rec_df.columns))
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    for name, error, details in processed.failures:
+        st.error(f"Error in processing {name}: {error}")
+        st.error(f"Detailed error: {details}")
+    
+    if not processed.results:
+        return
+    
+    st.markdown("### Results")
+    show_full_results = st.checkbox("Show full results", key="full_results")
+    for upload, result_df, _ in processed.results:
+        st.markdown(f"#### 📄 {upload.name}")
+        show_preview(result_df, show_full_results)
+    
+    if processed.write_error is not None:
+        st.markdown(
+            f'<div class="error-message">❌ Error writing file: {processed.write_error}</div>',
+            unsafe_allow_html=True
+        )
+    else:
+        # Download button
+        st.download_button(
+            label="📥 Download Processed File",
+            data=processed.download,
+            file_name=f"processed_sheets_{processed.timestamp}.xlsx",
+            mime="application/vnd.ms-excel"
+        )
+    
+    # Show success message with counts
+    matched_count = sum(matched for _, _, matched in processed.results)
+    total_count = sum(len(result_df) for _, result_df, _ in processed.results)
+    st.markdown(
+        f'<div class="success-message">✅ Processing completed successfully!<br>'
+        f'Processed {len(processed.results)} out of {len(uploads)} files. '
+        f'Matched {matched_count} out of {total_count} records.</div>',
+        unsafe_allow_html=True
+    )
 
 def main():
     st.title("📊 Excel Sheet Matcher")
     st.markdown("### Match and populate item names between sheets")
     
-    # Session state for storing DataFrames
-    if 'noc_df' not in st.session_state:
-        st.session_state.noc_df = None
-    if 'rec_df' not in st.session_state:
-        st.session_state.rec_df = None
+    # Session state for storing the NOC/REC sheets of every upload
+    if 'uploads' not in st.session_state:
+        st.session_state.uploads = []
+    if 'processed' not in st.session_state:
+        st.session_state.processed = None
     
     # File upload section
-    st.markdown("### Upload Excel File")
-    uploaded_file = st.file_uploader("Choose Excel file containing NOC and REC sheets", type=['xlsx'])
+    st.markdown("### Upload Excel Files")
+    uploaded_files = st.file_uploader(
+        "Choose Excel files containing NOC and REC sheets",
+        type=['xlsx'],
+        accept_multiple_files=True
+    )
 
-    if uploaded_file:
-        try:
-            # Read the Excel file
-            xls = pd.ExcelFile(uploaded_file)
-            sheets = xls.sheet_names
-            
-            # Find sheets regardless of case
-            noc_sheet, rec_sheet = find_sheet_names(sheets)
-            
-            if noc_sheet and rec_sheet:
-                st.markdown(f'<div class="success-message">✅ Found sheets: {noc_sheet} and {rec_sheet}</div>', 
-                          unsafe_allow_html=True)
-                
-                # Read both sheets and store in session state
-                st.session_state.noc_df = pd.read_excel(uploaded_file, sheet_name=noc_sheet)
-                st.session_state.rec_df = pd.read_excel(uploaded_file, sheet_name=rec_sheet)
-                
-                # Show data previews in tabs
-                st.markdown("### Sheet Contents")
-                tab1, tab2 = st.tabs([f"{noc_sheet} Sheet", f"{rec_sheet} Sheet"])
-                
-                with tab1:
-                    st.markdown(f"#### {noc_sheet} Sheet Data")
-                    st.markdown("**Column Names:**")
-                    st.write(list(st.session_state.noc_df.columns))
-                    st.dataframe(st.session_state.noc_df, use_container_width=True)
-                    st.markdown(f"Total rows: {len(st.session_state.noc_df)}")
+    if uploaded_files:
+        st.session_state.uploads = []
+        
+        for file_idx, uploaded_file in enumerate(uploaded_files):
+            st.markdown(f"### 📄 {uploaded_file.name}")
+            try:
+                # Read the Excel file (cached on the uploaded bytes)
+                file_bytes = uploaded_file.getvalue()
+                workbook = load_workbook_sheets(file_bytes)
+                sheets = list(workbook)
                 
-                with tab2:
-                    st.markdown(f"#### {rec_sheet} Sheet Data")
-                    st.markdown("**Column Names:**")
-                    st.write(list(st.session_state.rec_df.columns))
-                    st.dataframe(st.session_state.rec_df, use_container_width=True)
-                    st.markdown(f"Total rows: {len(st.session_state.rec_df)}")
+                # Find sheets regardless of case
+                noc_sheet, rec_sheet = find_sheet_names(sheets)
                 
-                # Process button
-                if st.button("Process Sheets"):
-                    with st.spinner("Processing sheets..."):
-                        result_df = process_sheets(st.session_state.noc_df, st.session_state.rec_df)
+                if noc_sheet and rec_sheet:
+                    st.markdown(f'<div class="success-message">✅ Found sheets: {noc_sheet} and {rec_sheet}</div>', 
+                              unsafe_allow_html=True)
+                    
+                    # Read both sheets and store them in session state
+                    noc_df = workbook[noc_sheet]
+                    rec_df = workbook[rec_sheet]
+                    st.session_state.uploads.append(Upload(
+                        uploaded_file.name, uploaded_file.file_id, file_bytes, noc_sheet, rec_sheet, noc_df, rec_df
+                    ))
+                    
+                    # Show data previews in tabs
+                    st.markdown("#### Sheet Contents")
+                    tab1, tab2 = st.tabs([f"{noc_sheet} Sheet", f"{rec_sheet} Sheet"])
+                    
+                    with tab1:
+                        st.markdown(f"#### {noc_sheet} Sheet Data")
+                        st.markdown("**Column Names:**")
+                        st.write(list(noc_df.columns))
+                        show_preview(noc_df, st.checkbox("Show full sheet", key=f"full_noc_{file_idx}"))
+                        st.markdown(f"Total rows: {len(noc_df)}")
+                    
+                    with tab2:
+                        st.markdown(f"#### {rec_sheet} Sheet Data")
+                        st.markdown("**Column Names:**")
+                        st.write(list(rec_df.columns))
+                        show_preview(rec_df, st.checkbox("Show full sheet", key=f"full_rec_{file_idx}"))
+                        st.markdown(f"Total rows: {len(rec_df)}")
+                else:
+                    missing_sheets = []
+                    if not noc_sheet:
+                        missing_sheets.append('NOC/NOV')
+                    if not rec_sheet:
+                        missing_sheets.append('REC')
                         
-                        if result_df is not None:
-                            st.markdown("### Results")
-                            st.dataframe(result_df, use_container_width=True)
-                            
-                            # Prepare download
-                            buffer = io.BytesIO()
-                            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                                result_df.to_excel(writer, sheet_name='Updated_REC', index=False)
-                            
-                            buffer.seek(0)
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            
-                            # Download button
-                            st.download_button(
-                                label="📥 Download Processed File",
-                                data=buffer,
-                                file_name=f"processed_sheets_{timestamp}.xlsx",
-                                mime="application/vnd.ms-excel"
-                            )
-                            
-                            # Show success message with counts
-                            matched_count = result_df['ITEM NAME'].notna().sum()
-                            total_count = len(result_df)
-                            st.markdown(
-                                f'<div class="success-message">✅ Processing completed successfully!<br>'
-                                f'Matched {matched_count} out of {total_count} records.</div>',
-                                unsafe_allow_html=True
-                            )
-            else:
-                missing_sheets = []
-                if not noc_sheet:
-                    missing_sheets.append('NOC/NOV')
-                if not rec_sheet:
-                    missing_sheets.append('REC')
+                    st.markdown(
+                        f'<div class="error-message">❌ Missing required sheets: {", ".join(missing_sheets)}. '
+                        f'Please ensure your Excel file contains both NOC/NOV and REC sheets.</div>',
+                        unsafe_allow_html=True
+                    )
                     
+                    st.markdown("Found sheets in uploaded file:")
+                    for sheet in sheets:
+                        st.markdown(f"- {sheet}")
+
+            except Exception as e:
                 st.markdown(
-                    f'<div class="error-message">❌ Missing required sheets: {", ".join(missing_sheets)}. '
-                    f'Please ensure your Excel file contains both NOC/NOV and REC sheets.</div>',
+                    f'<div class="error-message">❌ Error reading file: {str(e)}</div>',
                     unsafe_allow_html=True
                 )
-                
-                st.markdown("Found sheets in uploaded file:")
-                for sheet in sheets:
-                    st.markdown(f"- {sheet}")
-
-        except Exception as e:
-            st.markdown(
-                f'<div class="error-message">❌ Error reading file: {str(e)}</div>',
-                unsafe_allow_html=True
-            )
-            import traceback
-            st.error(f"Detailed error: {traceback.format_exc()}")
+                st.error(f"Detailed error: {traceback.format_exc()}")
+        
+        # Process button; results live in session state so reruns, such as
+        # ticking "Show full results", keep showing them
+        if st.session_state.uploads:
+            if st.button("Process Sheets"):
+                with st.spinner("Processing sheets..."):
+                    st.session_state.processed = process_sheets(st.session_state.uploads)
+            
+            processed = st.session_state.processed
+            if processed is not None and processed.uploads_key != uploads_key(st.session_state.uploads):
+                # The uploads changed since processing; drop the stale results
+                st.session_state.processed = processed = None
+            if processed is not None:
+                show_results(st.session_state.uploads, processed)
 
     else:
+        st.session_state.processed = None
         st.markdown(
-            '<div class="info-message">ℹ️ Please upload an Excel file containing both NOC/NOV and REC sheets.</div>',
+            '<div class="info-message">ℹ️ Please upload one or more Excel files containing both NOC/NOV and REC sheets.</div>',
             unsafe_allow_html=True
         )
 